@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 # Apply the patch BEFORE importing LiveKit
-from livekit_patch import apply_livekit_patch
+from livekit_patch import apply_livekit_patch, apply_orjson_patch
 apply_livekit_patch()
 
 from dotenv import load_dotenv
@@ -9,6 +9,7 @@ import os
 import logging
 import asyncio
 import re
+import time
 
 from livekit import agents
 from livekit.agents import AgentSession, Agent
@@ -19,8 +20,19 @@ from livekit.plugins import (
     silero,
 )
 
+# Needs the plugin modules loaded so their json parsing can be repointed
+apply_orjson_patch()
+
+from speech import clean_response_for_speech, stream_speech
+
 # ✅ Import from your existing RAG engine
-from rag_engine import initialize_rag_engine, get_rag_answer_async
+from rag_engine import (
+    initialize_rag_engine,
+    get_rag_answer_async,
+    get_rag_answer_stream,
+    query_cache_key,
+    RAG_UNAVAILABLE_ANSWER,
+)
 
 logging.basicConfig(level=logging.INFO)
 load_dotenv(".env.local")
@@ -38,50 +50,36 @@ class Assistant(Agent):
             )
         )
 
-def clean_response_for_speech(text: str) -> str:
-    """
-    Clean the response text to make it speech-friendly
-    Converts structured text into natural conversational speech
-    """
-    # Remove ALL markdown formatting completely
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)  # Remove **bold**
-    text = re.sub(r'\*(.*?)\*', r'\1', text)      # Remove *italic*
-    text = re.sub(r'_(.*?)_', r'\1', text)        # Remove _underline_
-    text = re.sub(r'`(.*?)`', r'\1', text)        # Remove `code`
-    
-    # Convert numbered lists to natural speech with connectors
-    # Replace "1. First item\n2. Second item" with "First, first item. Second, second item"
-    text = re.sub(r'\n(\d+)\. ', r'. Next, ', text)
-    text = re.sub(r'^(\d+)\. ', 'First, ', text)
-    
-    # Remove ALL bullet points, dashes, and list markers
-    text = re.sub(r'^[\s]*[-•*+]\s*', '', text, flags=re.MULTILINE)
-    text = re.sub(r'\n[\s]*[-•*+]\s*', '. Also, ', text)
-    
-    # Convert common structured patterns to speech
-    text = re.sub(r'\bNote:\s*', 'Please note that ', text, flags=re.IGNORECASE)
-    text = re.sub(r'\bImportant:\s*', 'This is important: ', text, flags=re.IGNORECASE)
-    text = re.sub(r'\bRemember:\s*', 'Remember that ', text, flags=re.IGNORECASE)
-    
-    # Remove ALL special characters and symbols that TTS reads aloud
-    text = re.sub(r'[#$%&@^`~|\\\[\]{}()<>"\']', '', text)
-    text = re.sub(r'[+=!?.,;:]', '', text)  # Remove punctuation that sounds weird
-    
-    # Replace slashes and other separators
-    text = re.sub(r'\s*/\s*', ' or ', text)
-    text = re.sub(r'/', ' or ', text)
-    text = re.sub(r'\s*-\s*', ' ', text)
-    
-    # Convert remaining numbered patterns to natural speech
-    text = re.sub(r'\b(\d+)\s*(hours?|days?|weeks?|months?|years?)\b', r'\1 \2', text)
-    text = re.sub(r'\b(\d+)\s*%', r'\1 percent', text)
-    
-    # Clean up extra whitespace and newlines
-    text = re.sub(r'\n+', ' ', text)
-    text = re.sub(r'\s+', ' ', text)
-    text = text.strip()
-    
-    return text
+# Casual intents in one alternation; the named group that matched picks the reply
+_CASUAL_RE = re.compile(
+    r"\b(?:"
+    r"(?P<greet>hi|hello|hey|good morning|good afternoon|good evening)"
+    r"|(?P<how>how are you|what's up|how's it going)"
+    r"|(?P<thanks>thank you|thanks)"
+    r"|(?P<bye>bye|goodbye)"
+    r"|(?P<help>what can you do|help me|what do you know)"
+    r")\b",
+    re.IGNORECASE,
+)
+
+_CASUAL_PROMPTS = {
+    "greet": "Say exactly: Hey there! I'm Nexi your SRM buddy. What do you wanna know about campus?",
+    "how": "Say exactly: I'm awesome thanks! Ready to help you with anything about SRM. What's on your mind?",
+    "thanks": "Say exactly: No problem! Always happy to help a fellow student. Ask me anything else!",
+    "bye": "Say exactly: See ya later! Come back anytime you need help with university stuff!",
+    "help": "Say exactly: I know tons about SRM like hostels fees classes library and campus life. What interests you most?",
+}
+
+# Final LLM prompts are reused for repeated questions within this window
+PROMPT_CACHE_TTL_SECONDS = 60 * 60
+PROMPT_CACHE_MAX_ENTRIES = 512
+
+# Speak RAG answers directly as they stream instead of rephrasing them through a second LLM call
+STREAM_RAG_ANSWERS = os.getenv("NEXI_STREAM_RAG_ANSWERS", "0") == "1"
+
+# Transcripts wait in a bounded queue drained by a fixed set of workers
+TRANSCRIPT_QUEUE_SIZE = 8
+TRANSCRIPT_WORKERS = 2
 
 async def entrypoint(ctx: agents.JobContext):
     try:
@@ -129,40 +127,45 @@ async def entrypoint(ctx: agents.JobContext):
             agent=assistant,
         )
 
+        # query_cache_key(query) -> (monotonic timestamp, final prompt)
+        prompt_cache = {}
+
         # === Function to handle RAG + reply ===
         async def answer_with_rag(user_query: str):
             try:
                 print(f"🔍 Processing query: {user_query}")
                 
-                # Check if it's a general greeting or casual question
-                casual_patterns = [
-                    r'\b(hi|hello|hey|good morning|good afternoon|good evening)\b',
-                    r'\b(how are you|what\'s up|how\'s it going)\b',
-                    r'\b(thank you|thanks|bye|goodbye)\b',
-                    r'\b(what can you do|help me|what do you know)\b'
-                ]
+                # Repeated questions skip classification, RAG and cleaning entirely
+                cache_key = query_cache_key(user_query)
+                cached = prompt_cache.get(cache_key)
+                if cached and time.monotonic() - cached[0] < PROMPT_CACHE_TTL_SECONDS:
+                    print(f"⚡ Prompt cache hit")
+                    await session.generate_reply(instructions=cached[1])
+                    return
                 
-                is_casual = any(re.search(pattern, user_query.lower()) for pattern in casual_patterns)
+                cacheable = True
                 
-                if is_casual:
+                # Check if it's a general greeting or casual question
+                casual_match = _CASUAL_RE.search(user_query)
+                
+                if casual_match:
                     # Handle casual conversation directly with super friendly responses
-                    if re.search(r'\b(hi|hello|hey|good morning|good afternoon|good evening)\b', user_query.lower()):
-                        prompt = "Say exactly: Hey there! I'm Nexi your SRM buddy. What do you wanna know about campus?"
-                    elif re.search(r'\b(how are you|what\'s up|how\'s it going)\b', user_query.lower()):
-                        prompt = "Say exactly: I'm awesome thanks! Ready to help you with anything about SRM. What's on your mind?"
-                    elif re.search(r'\b(thank you|thanks)\b', user_query.lower()):
-                        prompt = "Say exactly: No problem! Always happy to help a fellow student. Ask me anything else!"
-                    elif re.search(r'\b(bye|goodbye)\b', user_query.lower()):
-                        prompt = "Say exactly: See ya later! Come back anytime you need help with university stuff!"
-                    else:
-                        prompt = "Say exactly: I know tons about SRM like hostels fees classes library and campus life. What interests you most?"
+                    prompt = _CASUAL_PROMPTS[casual_match.lastgroup]
+                elif STREAM_RAG_ANSWERS:
+                    # First words reach TTS while the rest of the answer is still generating
+                    print(f"📤 Streaming RAG answer to TTS...")
+                    await session.say(stream_speech(get_rag_answer_stream(user_query)))
+                    return
                 else:
                     # Get answer from RAG engine for university-related questions
                     rag_answer = await get_rag_answer_async(user_query)
                     clean_answer = clean_response_for_speech(rag_answer)
+                    # Don't pin a transient retrieval failure for the whole TTL
+                    cacheable = rag_answer != RAG_UNAVAILABLE_ANSWER
                     
-                    # Check if RAG found relevant information
-                    if "don't know" in rag_answer.lower() or "cannot" in rag_answer.lower() or len(clean_answer.strip()) < 15:
+                    # Check if RAG found relevant information (lower-case the answer once for both checks)
+                    answer_low = rag_answer.lower()
+                    if "don't know" in answer_low or "cannot" in answer_low or len(clean_answer) < 15:
                         prompt = f"""
 You are Nexi, a friendly university assistant. A student asked: "{user_query}"
 
@@ -188,6 +191,13 @@ Respond in 15 words or less like you're texting a friend:
 - Start with words like Yeah, So, Basically, etc
 """
                 
+                if cacheable:
+                    prompt_cache.pop(cache_key, None)
+                    if len(prompt_cache) >= PROMPT_CACHE_MAX_ENTRIES:
+                        # Dicts keep insertion order, so the first key is the oldest
+                        del prompt_cache[next(iter(prompt_cache))]
+                    prompt_cache[cache_key] = (time.monotonic(), prompt)
+                
                 print(f"📤 Sending to LLM...")
                 await session.generate_reply(instructions=prompt)
                 
@@ -198,6 +208,30 @@ Respond in 15 words or less like you're texting a friend:
                     instructions="Sorry, I'm having trouble right now. Could you please ask your question again?"
                 )
 
+        # === Bounded work queue between transcription events and RAG ===
+        transcript_queue = asyncio.Queue(maxsize=TRANSCRIPT_QUEUE_SIZE)
+
+        async def transcript_worker():
+            while True:
+                user_text = await transcript_queue.get()
+                try:
+                    await answer_with_rag(user_text)
+                except Exception as e:
+                    print(f"❌ Task error: {e}")
+                finally:
+                    transcript_queue.task_done()
+
+        # Workers overlap retrieval for back-to-back utterances without spawning a task per event
+        transcript_workers = [
+            asyncio.create_task(transcript_worker()) for _ in range(TRANSCRIPT_WORKERS)
+        ]
+
+        async def stop_transcript_workers():
+            for worker in transcript_workers:
+                worker.cancel()
+
+        ctx.add_shutdown_callback(stop_transcript_workers)
+
         # === Initial Greeting ===
         await session.generate_reply(
             instructions="Say exactly: Hey! I'm Nexi your SRM buddy! Ask me anything about campus life hostels fees or whatever you need to know!"
@@ -213,17 +247,11 @@ Respond in 15 words or less like you're texting a friend:
                 user_text = event.text.strip()
                 print(f"👤 User said: {user_text}")
                 
-                # Create task for async operation
-                task = asyncio.create_task(answer_with_rag(user_text))
-                
-                # Add error handling for the task
-                def handle_task_result(task):
-                    try:
-                        task.result()
-                    except Exception as e:
-                        print(f"❌ Task error: {e}")
-                
-                task.add_done_callback(handle_task_result)
+                # Hand off to the workers; never block the event callback
+                try:
+                    transcript_queue.put_nowait(user_text)
+                except asyncio.QueueFull:
+                    print(f"⚠️ Too many pending questions, dropping: {user_text}")
                 
             except Exception as e:
                 print(f"❌ Error in transcription handler: {e}")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Check that streamed speech cleaning says the same thing as cleaning the whole answer at once
+
+Run: python check_speech.py
+"""
+
+import asyncio
+import sys
+
+from speech import clean_response_for_speech, stream_speech
+
+SAMPLES = [
+    "Here are the rules:\n1. Attend classes.\n2. Pay fees.\n3. Be nice.",
+    "The steps are: 1. Fill the form. 2. Pay the fee. 3. Submit it.",
+    "Hostel rules:\n- No guests after 9 PM.\n- Keep rooms clean.\n\nThanks!",
+    "*Below 75 percent you fail. Talk to your HOD.*",
+    "Note: minimum attendance is 75%. Students below that can't sit exams! Ask your advisor/HOD.",
+    "**Fees** are due in 2 weeks. Late fees apply after 10 days.",
+]
+
+async def _tokens(text, size):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+async def _streamed(text, size):
+    return "".join([chunk async for chunk in stream_speech(_tokens(text, size))]).strip()
+
+def check_stream_speech():
+    """Stream every sample at several token sizes and compare with whole-answer cleaning"""
+    failures = 0
+    for text in SAMPLES:
+        expected = clean_response_for_speech(text)
+        for size in (1, 3, 7, len(text)):
+            actual = asyncio.run(_streamed(text, size))
+            if actual != expected:
+                failures += 1
+                print(f"❌ Mismatch (token size {size}) for {text!r}\n   streamed: {actual!r}\n   expected: {expected!r}")
+    print("✅ Streamed speech matches full cleaning" if not failures else f"❌ {failures} mismatches")
+    return failures == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if check_stream_speech() else 1)
@@ -3,12 +3,25 @@
 Monkey patch for LiveKit agents to fix aiohttp ClientSession proxy issue
 """
 
+import inspect
+import json
+import sys
+import types
 import aiohttp
 from typing import Optional
 
+try:
+    import orjson
+except ImportError:  # Optional speed-up; stdlib json is used without it
+    orjson = None
+
 # Store the original ClientSession.__init__
 _original_client_session_init = aiohttp.ClientSession.__init__
 
+# aiohttp >= 3.10 accepts proxy= on ClientSession itself, so the wrapper (and its
+# extra Python frame on every session construction) is only needed on older versions
+_session_accepts_proxy = "proxy" in inspect.signature(_original_client_session_init).parameters
+
 def patched_client_session_init(self, *args, **kwargs):
     """
     Patched ClientSession.__init__ that removes the 'proxy' parameter
@@ -28,16 +41,73 @@ def apply_livekit_patch():
     """
     Apply the monkey patch to fix LiveKit aiohttp compatibility
     """
+    if _session_accepts_proxy:
+        print("✅ aiohttp supports ClientSession(proxy=...) natively - no patch needed")
+        return
     print("🔧 Applying LiveKit aiohttp compatibility patch...")
     aiohttp.ClientSession.__init__ = patched_client_session_init
     print("✅ Patch applied successfully!")
 
+# Stdlib json with loads swapped for orjson, installed as the 'json' name of
+# the LiveKit plugin modules only. dumps stays stdlib: orjson writes NaN/Inf as
+# null and encodes datetime/UUID/Enum that json.dumps rejects
+_plugin_json = types.ModuleType("json")
+_plugin_json.__dict__.update(json.__dict__)
+_patched_plugin_modules = []
+_original_aiohttp_loads = {}
+
+def orjson_loads(s, **kwargs):
+    """
+    json.loads replacement backed by orjson. Extra options and inputs orjson
+    rejects (NaN/Infinity, lone surrogates) fall back to the stdlib. Integers
+    past 64 bits come back as floats, which STT/TTS server messages never carry
+    """
+    if not kwargs:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(s, **kwargs)
+
+_plugin_json.loads = orjson_loads
+
+def _aiohttp_json_methods():
+    """aiohttp methods that bind json.loads as a keyword default at import time"""
+    return [aiohttp.ClientResponse.json, aiohttp.ClientWebSocketResponse.receive_json]
+
+def apply_orjson_patch():
+    """
+    Parse the STT/TTS plugins' per-message JSON with orjson. Call after the
+    plugins are imported: their modules' 'json' name and aiohttp's loads
+    defaults are repointed, the global json module is left alone
+    """
+    if orjson is None:
+        print("⚠️ orjson not installed - using stdlib json")
+        return
+    print("🔧 Applying orjson JSON patch...")
+    for name, module in list(sys.modules.items()):
+        if name.startswith("livekit.plugins.") and getattr(module, "json", None) is json:
+            module.json = _plugin_json
+            _patched_plugin_modules.append(module)
+    for method in _aiohttp_json_methods():
+        defaults = method.__kwdefaults__ or {}
+        if "loads" in defaults:
+            _original_aiohttp_loads[method] = defaults["loads"]
+            defaults["loads"] = orjson_loads
+    print(f"✅ orjson patch applied to {len(_patched_plugin_modules)} plugin modules!")
+
 def remove_livekit_patch():
     """
     Remove the monkey patch (restore original behavior)
     """
     print("🔄 Removing LiveKit patch...")
     aiohttp.ClientSession.__init__ = _original_client_session_init
+    for module in _patched_plugin_modules:
+        module.json = json
+    _patched_plugin_modules.clear()
+    for method, loads in _original_aiohttp_loads.items():
+        method.__kwdefaults__["loads"] = loads
+    _original_aiohttp_loads.clear()
     print("✅ Original behavior restored!")
 
 if __name__ == "__main__":
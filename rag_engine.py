@@ -1,9 +1,17 @@
 # rag_engine.py
 import chromadb
+from chromadb.errors import ChromaError
 import logging
 import asyncio
+import hashlib
 import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
+import torch
 from dotenv import load_dotenv
 from llama_index.core import (
     SimpleDirectoryReader,
@@ -11,7 +19,9 @@ from llama_index.core import (
     StorageContext,
     Settings,
     Document,
+    QueryBundle,
 )
+from llama_index.core.bridge.pydantic import PrivateAttr
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.chroma import ChromaVectorStore
@@ -25,6 +35,16 @@ load_dotenv(".env.local")
 DATA_DIR = Path("./Nexi Data")  # Folder where your PDFs are stored
 PERSIST_DIR = Path("./chromadb")              # Folder where vector DB will be saved
 PERSIST_DIR.mkdir(parents=True, exist_ok=True)
+COLLECTION_NAME = "university_data"
+# MiniLM embeddings are unit-normalised, so cosine distance is their native metric.
+# search_ef is raised from Chroma's default of 10 so the top 3 chunks are found reliably.
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 100,
+    "hnsw:search_ef": 32,
+    "hnsw:M": 16,
+}
+SIMILARITY_TOP_K = 3  # Chunks per answer; fewer chunks means a shorter LLM prompt for voice
 
 # ✅ FIXED: Set up Groq LLM for proper chunk processing
 groq_api_key = os.getenv("GROQ_API_KEY")
@@ -58,22 +78,121 @@ UNIVERSITY_PROMPT = PromptTemplate(
     """
 )
 
+# Semantic cache: a query whose embedding is this close (cosine) to a cached one reuses its answer
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_MAX_ENTRIES = 1024
+
+# Embedding model
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_DIM = 384  # all-MiniLM-L6-v2 output size
+EMBED_CACHE_PATH = Path("./embedding_cache.sqlite3")  # Chunk text hash -> embedding, reused across ingests
+EMBED_BATCH_SIZE = 64  # Chunks per forward pass during ingestion
+
+# Dynamic int8 quantization of the embedding model's Linear layers (CPU only)
+QUANTIZE_EMBEDDINGS = os.getenv("RAG_QUANTIZE_EMBEDDINGS", "1") == "1"
+
+# Bounded concurrency for the async path: embedding threads and in-flight LLM calls
+RAG_EXECUTOR_WORKERS = 4
+RAG_MAX_CONCURRENT_QUERIES = 8
+
+# Common questions answered in the background at startup so the first live ones hit warm caches
+WARMUP_QUERIES = [
+    "What is the minimum attendance percentage required?",
+    "What are the hostel fees?",
+    "What is considered academic misconduct?",
+    "When do the end semester exams start?",
+]
+
+# Returned when retrieval fails, so callers can tell it apart from a real answer
+RAG_UNAVAILABLE_ANSWER = "Sorry, I could not retrieve the answer right now."
+
 # ---------------- LOGGING ---------------- #
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("RAG")
 
+# ---------------- CACHE KEYS ---------------- #
+def query_cache_key(query: str) -> bytes:
+    """Fixed-size key for exact-match query caches: 16-byte BLAKE2b of the normalised query."""
+    return hashlib.blake2b(query.strip().lower().encode("utf-8"), digest_size=16).digest()
+
+# ---------------- EMBEDDINGS ---------------- #
+class CachedEmbedding(HuggingFaceEmbedding):
+    """HuggingFaceEmbedding that keeps document chunk embeddings in an on-disk cache keyed by content hash."""
+
+    _cache_namespace: bytes = PrivateAttr()
+    _cache: sqlite3.Connection = PrivateAttr()
+    _cache_lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, cache_path: Path = EMBED_CACHE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.set_cache_namespace(self.model_name)
+        self._cache = sqlite3.connect(str(cache_path), check_same_thread=False)
+        self._cache.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._cache_lock = threading.Lock()
+
+    def set_cache_namespace(self, namespace: str):
+        """Mix namespace into every cache key; change it whenever the model's weights change."""
+        self._cache_namespace = namespace.encode("utf-8") + b"\0"
+
+    def _cache_key(self, text: str) -> bytes:
+        return hashlib.blake2b(self._cache_namespace + text.encode("utf-8"), digest_size=16).digest()
+
+    def _get_text_embeddings(self, texts):
+        """Embed only the chunks missing from the cache, in one batch, and store the new vectors."""
+        keys = [self._cache_key(text) for text in texts]
+        with self._cache_lock:
+            placeholders = ",".join("?" * len(keys))
+            cached = dict(self._cache.execute(
+                f"SELECT key, vector FROM chunk_embeddings WHERE key IN ({placeholders})", keys
+            ))
+
+        misses = [i for i, key in enumerate(keys) if key not in cached]
+        if misses:
+            fresh = super()._get_text_embeddings([texts[i] for i in misses])
+            rows = [
+                (keys[i], np.asarray(vector, dtype=np.float32).tobytes())
+                for i, vector in zip(misses, fresh)
+            ]
+            with self._cache_lock:
+                self._cache.executemany("INSERT OR REPLACE INTO chunk_embeddings VALUES (?, ?)", rows)
+                self._cache.commit()
+            cached.update(rows)
+
+        return [np.frombuffer(cached[key], dtype=np.float32).tolist() for key in keys]
+
 # ---------------- RAG ENGINE ---------------- #
 class UniversityRAGEngine:
     def __init__(self):
         """Initialize embedding model, Chroma, and query engine."""
         logger.info("Initializing University RAG Engine...")
-        self.embed_model = HuggingFaceEmbedding(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
+        self.embed_model = CachedEmbedding(
+            model_name=EMBED_MODEL_NAME,
+            normalize=True,  # Unit vectors at ingest and query time
+            embed_batch_size=EMBED_BATCH_SIZE,
         )
+        quantized = QUANTIZE_EMBEDDINGS and self._quantize_embed_model()
+        self.embed_precision = "int8" if quantized else "fp32"
+        # FP32 and int8 models produce different vectors, so they never share cache keys
+        self.embed_model.set_cache_namespace(f"{EMBED_MODEL_NAME}:{self.embed_precision}")
         Settings.embed_model = self.embed_model
+        # First call loads tokenizer/weights and warms the torch kernels
+        self.embed_model.get_query_embedding("warmup")
+
+        # Unit-normalised query embeddings (one row per entry) and their answers
+        self._sem_cache_keys = np.empty((0, EMBED_DIM), dtype=np.float32)
+        self._sem_cache_vals = []
+        self._sem_cache_lock = threading.Lock()
+
+        # Dedicated pool for blocking embedding and Chroma search work instead of the unbounded default executor
+        self._executor = ThreadPoolExecutor(max_workers=RAG_EXECUTOR_WORKERS, thread_name_prefix="rag")
+        self._sem = asyncio.Semaphore(RAG_MAX_CONCURRENT_QUERIES)
+        # query_cache_key(query) -> future of the answer currently being computed for it
+        self._inflight = {}
 
         self.client = chromadb.PersistentClient(path=str(PERSIST_DIR))
-        self.collection = self.client.get_or_create_collection("university_data")
+        self.collection = self._get_collection()
         self.vector_store = ChromaVectorStore(chroma_collection=self.collection)
         self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
 
@@ -89,14 +208,56 @@ class UniversityRAGEngine:
 
         # Build query engine with maximum accuracy
         self.query_engine = self.index.as_query_engine(
-            similarity_top_k=5,  # Increased to get more relevant context
+            similarity_top_k=SIMILARITY_TOP_K,
             response_mode="compact",  # Simple and direct responses
-            use_async=False,
+            use_async=False,  # Only tree_summarize/accumulate use it; "compact" ignores it
             streaming=False,
             verbose=False  # Disable verbose to reduce noise
         )
+        # Same retrieval, but yields tokens as the LLM produces them (for speech streaming)
+        self.stream_query_engine = self.index.as_query_engine(
+            similarity_top_k=SIMILARITY_TOP_K,
+            response_mode="compact",
+            streaming=True,
+            verbose=False
+        )
         logger.info("RAG Engine ready.")
 
+    def _get_collection(self):
+        """Open the Chroma collection, rebuilding it if it was created with different settings."""
+        # Chunks embedded at one precision must not be searched with query vectors from the other
+        metadata = {**COLLECTION_METADATA, "embed_precision": self.embed_precision}
+        # Inspect the existing collection before creating anything: some chromadb releases let
+        # get_or_create_collection overwrite metadata, which would hide a stale index
+        try:
+            collection = self.client.get_collection(COLLECTION_NAME)
+        except (ValueError, ChromaError):  # Not found (ValueError on older chromadb)
+            return self.client.create_collection(COLLECTION_NAME, metadata=metadata)
+        current = collection.metadata or {}
+        stale = {key: current.get(key) for key, value in metadata.items() if current.get(key) != value}
+        if stale:
+            # Chroma can't change the index settings in place; dropping it triggers a fresh ingest
+            logger.info(f"Collection has outdated settings {stale} — rebuilding.")
+            self.client.delete_collection(COLLECTION_NAME)
+            collection = self.client.create_collection(COLLECTION_NAME, metadata=metadata)
+        return collection
+
+    def _quantize_embed_model(self) -> bool:
+        """Swap in an int8 dynamically quantized copy of the model on CPU; True only if that happened."""
+        model = self.embed_model._model
+        try:
+            if next(model.parameters()).device.type != "cpu":
+                logger.info("Embedding model is not on CPU; skipping int8 quantization.")
+                return False
+            self.embed_model._model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            logger.info("Embedding model quantized to int8.")
+            return True
+        except Exception as e:
+            logger.warning(f"Embedding quantization failed, using FP32 model: {e}")
+            return False
+
     def _ingest_documents(self):
         """Load PDFs from DATA_DIR, embed and store them in Chroma with improved chunking."""
         if not DATA_DIR.exists():
@@ -117,37 +278,184 @@ class UniversityRAGEngine:
         text_splitter = SentenceSplitter(
             chunk_size=512,  # Smaller chunks for better accuracy
             chunk_overlap=50,  # Some overlap to maintain context
-            separator=" "
+            separator=" ",
+            include_metadata=False  # Keep file metadata out of chunk text sent to the LLM
         )
         
         # Process documents with improved chunking
         logger.info("Processing documents with improved chunking...")
+        start = time.perf_counter()
         self.index = VectorStoreIndex.from_documents(
             documents,
             storage_context=self.storage_context,
             embed_model=self.embed_model,
-            transformations=[text_splitter]  # Apply custom chunking
+            transformations=[text_splitter],  # Apply custom chunking
+            show_progress=True
         )
+        logger.info(f"Embedded and indexed documents in {time.perf_counter() - start:.1f}s.")
         
         self.index.storage_context.persist()
         logger.info(f"Documents successfully ingested with {len(documents)} files and improved chunking.")
 
-    def get_rag_answer(self, query: str) -> str:
-        """Query the vector database and return an answer."""
+    def _semantic_cache_lookup(self, q_vec: np.ndarray):
+        """Return the cached answer for the nearest previous query, if it is close enough."""
+        with self._sem_cache_lock:
+            if not self._sem_cache_vals:
+                return None
+            sims = self._sem_cache_keys @ q_vec
+            best = int(np.argmax(sims))
+            if sims[best] >= SEMANTIC_CACHE_THRESHOLD:
+                return self._sem_cache_vals[best]
+        return None
+
+    def _semantic_cache_store(self, q_vec: np.ndarray, answer: str):
+        """Remember an answer, evicting the oldest entry once the cache is full."""
+        with self._sem_cache_lock:
+            if len(self._sem_cache_vals) >= SEMANTIC_CACHE_MAX_ENTRIES:
+                self._sem_cache_keys = np.delete(self._sem_cache_keys, 0, axis=0)
+                del self._sem_cache_vals[0]
+            self._sem_cache_keys = np.vstack([self._sem_cache_keys, q_vec])
+            self._sem_cache_vals.append(answer)
+
+    def _embed_query(self, query: str, q_emb=None):
+        """Embed a query (unless already embedded), returning the raw embedding and its unit-normalised vector."""
+        if q_emb is None:
+            q_emb = self.embed_model.get_query_embedding(query)
+        q_vec = np.asarray(q_emb, dtype=np.float32)
+        # Not in place: asarray may return the caller's own array
+        q_vec = q_vec / (np.linalg.norm(q_vec) or 1.0)
+        return q_emb, q_vec
+
+    def get_rag_answer(self, query: str, q_emb=None) -> str:
+        """Query the vector database and return an answer, reusing q_emb if the caller already embedded the query."""
+        if not query.strip():
+            return "Please ask a valid question."
+        try:
+            q_emb, q_vec = self._embed_query(query, q_emb)
+
+            cached = self._semantic_cache_lookup(q_vec)
+            if cached is not None:
+                logger.info(f"Semantic cache hit: {query}")
+                return cached
+
+            logger.info(f"Querying RAG engine: {query}")
+            response = self.query_engine.query(QueryBundle(query_str=query, embedding=q_emb))
+            answer = str(response)
+            self._semantic_cache_store(q_vec, answer)
+            return answer
+        except Exception as e:
+            logger.error(f"RAG query failed: {e}")
+            return RAG_UNAVAILABLE_ANSWER
+
+    def warm_up(self):
+        """Answer WARMUP_QUERIES to populate the semantic cache and Chroma's page cache."""
+        for query in WARMUP_QUERIES:
+            self.get_rag_answer(query)
+        logger.info(f"RAG warm-up complete ({len(WARMUP_QUERIES)} queries).")
+
+    async def _aembed_query(self, query: str, q_emb=None):
+        """Async _embed_query; encoding is CPU-bound, so it runs on the bounded pool."""
+        if q_emb is not None:
+            return self._embed_query(query, q_emb)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._embed_query, query)
+
+    async def _aretrieve(self, engine, bundle: QueryBundle):
+        """Run the Chroma search on the executor; ChromaVectorStore's async query is the sync one."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, engine.retrieve, bundle)
+
+    async def get_rag_answer_async(self, query: str, q_emb=None) -> str:
+        """Async query path for LiveKit integration; q_emb is reused as in get_rag_answer."""
         if not query.strip():
             return "Please ask a valid question."
+
+        # Single-flight: identical queries arriving together share one embed + retrieve + generate
+        key = query_cache_key(query)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            logger.info(f"Joining in-flight query: {query}")
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            answer = await self._answer_async(query, q_emb)
+            future.set_result(answer)
+            return answer
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _answer_async(self, query: str, q_emb=None) -> str:
+        """Embed, check the semantic cache, then retrieve and generate the answer."""
         try:
+            q_emb, q_vec = await self._aembed_query(query, q_emb)
+
+            cached = self._semantic_cache_lookup(q_vec)
+            if cached is not None:
+                logger.info(f"Semantic cache hit: {query}")
+                return cached
+
             logger.info(f"Querying RAG engine: {query}")
-            response = self.query_engine.query(query)
-            return str(response)
+            bundle = QueryBundle(query_str=query, embedding=q_emb)
+            nodes = await self._aretrieve(self.query_engine, bundle)
+            async with self._sem:
+                response = await self.query_engine.asynthesize(bundle, nodes)
+            answer = str(response)
+            self._semantic_cache_store(q_vec, answer)
+            return answer
         except Exception as e:
             logger.error(f"RAG query failed: {e}")
-            return "Sorry, I could not retrieve the answer right now."
+            return RAG_UNAVAILABLE_ANSWER
+
+    async def _generate_stream(self, bundle: QueryBundle, nodes, tokens: asyncio.Queue):
+        """Stream the LLM answer into tokens under the semaphore; None marks the end."""
+        try:
+            async with self._sem:
+                response = await self.stream_query_engine.asynthesize(bundle, nodes)
+                async for token in response.async_response_gen():
+                    tokens.put_nowait(token)
+        finally:
+            tokens.put_nowait(None)
+
+    async def get_rag_answer_stream(self, query: str, q_emb=None):
+        """Async generator yielding the answer as the LLM streams it, so speech can start early."""
+        if not query.strip():
+            yield "Please ask a valid question."
+            return
+        parts = []
+        try:
+            q_emb, q_vec = await self._aembed_query(query, q_emb)
+
+            cached = self._semantic_cache_lookup(q_vec)
+            if cached is not None:
+                logger.info(f"Semantic cache hit: {query}")
+                yield cached
+                return
 
-    async def get_rag_answer_async(self, query: str) -> str:
-        """Async wrapper for LiveKit integration."""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self.get_rag_answer, query)
+            logger.info(f"Streaming RAG answer: {query}")
+            bundle = QueryBundle(query_str=query, embedding=q_emb)
+            nodes = await self._aretrieve(self.stream_query_engine, bundle)
+            # Tokens are read at TTS speed, so generation runs in its own task and frees
+            # its LLM slot when the answer is generated, not when it has been spoken
+            tokens = asyncio.Queue()
+            producer = asyncio.create_task(self._generate_stream(bundle, nodes, tokens))
+            try:
+                while (token := await tokens.get()) is not None:
+                    parts.append(token)
+                    yield token
+                await producer  # Re-raise a generation failure
+            finally:
+                producer.cancel()
+            self._semantic_cache_store(q_vec, "".join(parts))
+        except Exception as e:
+            logger.error(f"RAG stream failed: {e}")
+            # Only apologise if nothing has been spoken yet
+            if not parts:
+                yield RAG_UNAVAILABLE_ANSWER
 
 # ---------------- GLOBAL INSTANCE ---------------- #
 _rag_engine = None
@@ -156,6 +464,8 @@ def initialize_rag_engine():
     global _rag_engine
     if _rag_engine is None:
         _rag_engine = UniversityRAGEngine()
+        # Warm up in the background so startup isn't blocked on LLM calls
+        threading.Thread(target=_rag_engine.warm_up, name="rag-warmup", daemon=True).start()
     return _rag_engine
 
 def get_rag_answer(query: str):
@@ -170,6 +480,13 @@ async def get_rag_answer_async(query: str):
         initialize_rag_engine()
     return await _rag_engine.get_rag_answer_async(query)
 
+async def get_rag_answer_stream(query: str):
+    global _rag_engine
+    if _rag_engine is None:
+        initialize_rag_engine()
+    async for token in _rag_engine.get_rag_answer_stream(query):
+        yield token
+
 # ---------------- TEST ---------------- #
 if __name__ == "__main__":
     print("=== University RAG Engine Test ===")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Speech-friendly cleanup of LLM answers for Nexi's TTS, whole or streamed
+"""
+
+import re
+
+# Precompiled patterns for clean_response_for_speech (runs on every reply)
+_BOLD_RE = re.compile(r'\*\*(.*?)\*\*')
+_ITALIC_RE = re.compile(r'\*(.*?)\*')
+_UNDERLINE_RE = re.compile(r'_(.*?)_')
+_CODE_RE = re.compile(r'`(.*?)`')
+_NUMBERED_NEWLINE_RE = re.compile(r'\n(\d+)\. ')
+_NUMBERED_LEADING_RE = re.compile(r'^(\d+)\. ')
+_BULLET_LINE_RE = re.compile(r'^[\s]*[-•*+]\s*', re.MULTILINE)
+_BULLET_NEWLINE_RE = re.compile(r'\n[\s]*[-•*+]\s*')
+_CALLOUT_RE = re.compile(r'\b(?:(?P<note>Note)|(?P<important>Important)|(?P<remember>Remember)):\s*', re.IGNORECASE)
+_CALLOUT_SPEECH = {
+    "note": 'Please note that ',
+    "important": 'This is important: ',
+    "remember": 'Remember that ',
+}
+_DURATION_RE = re.compile(r'\b(\d+)\s*(hours?|days?|weeks?|months?|years?)\b')
+_PERCENT_RE = re.compile(r'\b(\d+)\s*%')
+_BULLET_MARKERS = ('-', '•', '*', '+')
+
+# One translate pass deletes symbols TTS reads aloud and punctuation that sounds
+# weird, and turns dashes into spaces. Whitespace around a dash or slash is left
+# for the final collapse, which matches the old \s*-\s* and \s*/\s* passes.
+_SPEECH_TRANSLATE_TABLE = str.maketrans('-', ' ', '#$%&@^`~|\\[]{}()<>"\'' + '+=!?.,;:')
+
+def clean_response_for_speech(text: str) -> str:
+    """
+    Clean the response text to make it speech-friendly
+    Converts structured text into natural conversational speech
+    """
+    # Each substitution is gated on a cheap substring check, since most RAG
+    # answers contain little or no markup and the regex can be skipped entirely
+    # Remove ALL markdown formatting completely
+    if '*' in text:
+        if '**' in text:
+            text = _BOLD_RE.sub(r'\1', text)   # Remove **bold**
+        text = _ITALIC_RE.sub(r'\1', text)     # Remove *italic*
+    if '_' in text:
+        text = _UNDERLINE_RE.sub(r'\1', text)  # Remove _underline_
+    if '`' in text:
+        text = _CODE_RE.sub(r'\1', text)       # Remove `code`
+    
+    # Convert numbered lists to natural speech with connectors
+    # Replace "1. First item\n2. Second item" with "First, first item. Second, second item"
+    if '. ' in text:
+        text = _NUMBERED_NEWLINE_RE.sub(r'. Next, ', text)
+        text = _NUMBERED_LEADING_RE.sub('First, ', text)
+    
+    # Remove ALL bullet points, dashes, and list markers
+    if any(marker in text for marker in _BULLET_MARKERS):
+        text = _BULLET_LINE_RE.sub('', text)
+        if '\n' in text:
+            text = _BULLET_NEWLINE_RE.sub('. Also, ', text)
+    
+    # Convert common structured patterns to speech
+    # (one scan for all three labels; the callback only runs on an actual match)
+    if ':' in text:
+        text = _CALLOUT_RE.sub(lambda m: _CALLOUT_SPEECH[m.lastgroup], text)
+    
+    # Remove ALL special characters and symbols that TTS reads aloud
+    text = text.translate(_SPEECH_TRANSLATE_TABLE)
+    
+    # Replace slashes and other separators (dashes are handled by the table above)
+    if '/' in text:
+        text = text.replace('/', ' or ')
+    
+    # Convert remaining numbered patterns to natural speech
+    text = _DURATION_RE.sub(r'\1 \2', text)
+    if '%' in text:
+        text = _PERCENT_RE.sub(r'\1 percent', text)
+    
+    # Clean up extra whitespace and newlines in one split/join (same as \s+ -> ' ' plus strip)
+    text = ' '.join(text.split())
+    
+    return text
+
+# Sentence boundaries for streamed answers (not the "1." of a numbered list).
+# A newline stays at the start of the next segment, so "\n2. " still becomes
+# "Next" exactly as it does when the whole answer is cleaned at once.
+_SENTENCE_END_RE = re.compile(r'(?<!\d)[.!?][^\S\n]+|(?=\n)')
+
+def _open_markup(text: str) -> bool:
+    """True while a **bold**, *italic*, _underline_ or `code` span is still open"""
+    return (
+        text.count('**') % 2 == 1
+        or text.replace('**', '').count('*') % 2 == 1
+        or text.count('_') % 2 == 1
+        or text.count('`') % 2 == 1
+    )
+
+async def stream_speech(tokens):
+    """
+    Regroup streamed LLM tokens into sentences and clean each one for speech
+    as soon as it is complete, so TTS can start before the answer finishes
+    """
+    buffer = ""
+    # Only the first segment starts the answer. Later ones get a '.' (deleted by
+    # the translate table) in front so cleaning's start-of-text rules, "2. " ->
+    # "First" and "* " as a bullet, don't fire at every sentence start
+    prefix = ""
+    async for token in tokens:
+        buffer += token
+        # Search from 1 so a segment that starts with its newline isn't split off empty
+        start = 1
+        while (boundary := _SENTENCE_END_RE.search(buffer, start)):
+            # Markup never spans a line, but within one a span mustn't be cut in half
+            if boundary.group() and _open_markup(buffer[:boundary.end()]):
+                start = boundary.end()
+                continue
+            sentence, buffer = buffer[:boundary.end()], buffer[boundary.end():]
+            start = 1
+            sentence = clean_response_for_speech(prefix + sentence)
+            prefix = "."
+            if sentence:
+                yield sentence + " "
+    sentence = clean_response_for_speech(prefix + buffer)
+    if sentence:
+        yield sentence